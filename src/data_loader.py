@@ -21,11 +21,47 @@ Usage:
 import os
 import json
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Optional, Dict, Any
 
 CURRENT_DATE = datetime(2024, 5, 1)
 
+# Column schemas for read_csv, so pandas skips type inference
+PATIENT_DTYPES = {
+    "patient_id": "string",
+    "date_of_birth": "string",
+    "gender": "category",
+    "height_cm": "float64",
+    "weight_kg": "float64",
+    "cigs_per_day": "float64",
+    "years_smoked": "float64",
+}
+# Left to pandas' inference, so values convert with bool() as before (a blank is True)
+INFERRED_PATIENT_COLUMNS = ["is_smoker"]
+LAB_DTYPES = {
+    "patient_id": "string",
+    "lab_test_name": "category",
+    "value": "string",  # converted by parse_lab_values; results like "<50" are not numbers
+    "unit": "category",
+}
+LAB_DATE_COLUMN = "observation_date"
+
+# Rows per lab CSV chunk; bounds peak memory on large lab files
+LAB_CHUNKSIZE = 1_000_000
+
+# Numeric patient columns that are optional in patients.csv
+OPTIONAL_NUMERIC_COLUMNS = ["height_cm", "weight_kg", "cigs_per_day", "years_smoked"]
+
+# Derived fields, None when they cannot be computed; raw CSV fields keep NaN for blanks
+DERIVED_COLUMNS = ["age", "BMI", "pack_years"]
+
+# Fields copied into each patient profile (in order)
+PROFILE_COLUMNS = [
+    "patient_id", "date_of_birth", "age", "gender", "is_smoker",
+    "height_cm", "weight_kg", "BMI", "cigs_per_day", "years_smoked", "pack_years",
+]
+
 
 def calculate_age(dob: str) -> Optional[int]:
     """Calculate patient age at CURRENT_DATE."""
@@ -48,6 +84,19 @@ def calculate_bmi(weight_kg, height_cm) -> Optional[float]:
         return None
 
 
+def round_vec(values: pd.Series, ndigits: int = 1) -> pd.Series:
+    """
+    Round each value with Python's round(), as the scalar helpers do.
+    Series.round scales and rounds half to even in floating point, so e.g. 1.15 becomes 1.2, not 1.1.
+    """
+    return values.map(lambda x: round(x, ndigits), na_action="ignore")
+
+
+def calculate_bmi_vec(weight_kg: pd.Series, height_cm: pd.Series) -> pd.Series:
+    """Column form of calculate_bmi: BMI per row, NaN where height is missing or zero."""
+    return round_vec((weight_kg / (height_cm / 100) ** 2).where(height_cm != 0))
+
+
 def calculate_pack_years(cigs_per_day, years_smoked) -> Optional[float]:
     """Compute pack-years if smoking data is available."""
     if pd.isna(cigs_per_day) or pd.isna(years_smoked):
@@ -59,85 +108,150 @@ def calculate_pack_years(cigs_per_day, years_smoked) -> Optional[float]:
 
 
 def load_patients(patients_csv: str) -> dict:
-    """Load patient demographics and compute derived metrics."""
-    df = pd.read_csv(patients_csv)
-    patients = {}
+    """Load patient demographics and compute derived metrics (vectorized)."""
+    df = pd.read_csv(patients_csv, engine="c", dtype=PATIENT_DTYPES,
+                     usecols=lambda col: col in PATIENT_DTYPES or col in INFERRED_PATIENT_COLUMNS)
+
+    # Optional columns may be absent from the CSV; treat them as missing values
+    absent = [col for col in OPTIONAL_NUMERIC_COLUMNS + ["date_of_birth", "gender"]
+              if col not in df.columns]
+    for col in OPTIONAL_NUMERIC_COLUMNS:
+        if col not in df.columns:
+            df[col] = float("nan")
+    if "is_smoker" not in df.columns:
+        df["is_smoker"] = False
+    for col in ("date_of_birth", "gender"):
+        if col not in df.columns:
+            df[col] = None
+
+    dob = pd.to_datetime(df["date_of_birth"], format="%Y-%m-%d", errors="coerce")
+    age = (pd.Timestamp(CURRENT_DATE) - dob).dt.days // 365
+    bmi = calculate_bmi_vec(df["weight_kg"], df["height_cm"])
+    pack_years = round_vec((df["cigs_per_day"] / 20.0) * df["years_smoked"])
+
+    profiles = df.assign(
+        age=age.astype("Int64"),
+        is_smoker=df["is_smoker"].map(bool),
+        BMI=bmi,
+        pack_years=pack_years,
+    )[PROFILE_COLUMNS]
+    profiles = profiles.astype(object)
+    profiles = profiles.where(profiles.notna(), float("nan"))
+    profiles[DERIVED_COLUMNS] = profiles[DERIVED_COLUMNS].where(profiles[DERIVED_COLUMNS].notna(), None)
+    profiles[absent] = None  # as row.get() gave for a column not in the CSV
 
-    for _, row in df.iterrows():
-        pid = row["patient_id"]
-        dob = row.get("date_of_birth")
-
-        patients[pid] = {
-            "patient_id": pid,
-            "date_of_birth": dob,
-            "age": calculate_age(dob),
-            "gender": row.get("gender"),
-            "is_smoker": bool(row.get("is_smoker", False)),
-            "height_cm": row.get("height_cm"),
-            "weight_kg": row.get("weight_kg"),
-            "BMI": calculate_bmi(row.get("weight_kg"), row.get("height_cm")),
-            "cigs_per_day": row.get("cigs_per_day"),
-            "years_smoked": row.get("years_smoked"),
-            "pack_years": calculate_pack_years(row.get("cigs_per_day"), row.get("years_smoked")),
-            "labs": [],
-            "latest_labs": {},  # filled by attach_labs_to_patients
-            "notes": ""  # will be populated by attach_notes_to_patients
-        }
+    patients = {}
+    for record in profiles.to_dict(orient="records"):
+        record["labs"] = []
+        record["latest_labs"] = {}  # filled by attach_labs_to_patients
+        record["notes"] = ""  # will be populated by attach_notes_to_patients
+        patients[record["patient_id"]] = record
 
     return patients
 
 
-def load_lab_results(labs_csv: str) -> pd.DataFrame:
-    """Load lab results into a DataFrame."""
-    return pd.read_csv(labs_csv)
+def load_lab_results(labs_csv: str, chunksize: Optional[int] = None):
+    """
+    Load lab results into a DataFrame.
+    With chunksize, return an iterator of DataFrames instead.
+    """
+    return pd.read_csv(labs_csv, engine="c", dtype=LAB_DTYPES,
+                       usecols=lambda col: col in LAB_DTYPES or col == LAB_DATE_COLUMN,
+                       parse_dates=[LAB_DATE_COLUMN], date_format="%Y-%m-%d",
+                       chunksize=chunksize)
+
+
+def parse_lab_values(raw: pd.Series) -> pd.Series:
+    """
+    Lab values as floats where they parse as numbers (NaN when blank). Other results (e.g. "<50")
+    keep their text, so the evaluator reports them as unevaluable instead of the load failing.
+    """
+    numeric = pd.to_numeric(raw, errors="coerce").astype("float64")
+    return numeric.astype(object).where(numeric.notna() | raw.isna(), raw.astype(object))
 
 
 def attach_labs_to_patients(patients: dict, labs_df: pd.DataFrame):
-    """Attach lab results (history + most recent per test) to patient profiles."""
-    for _, row in labs_df.iterrows():
-        pid = row["patient_id"]
-        if pid not in patients:
-            continue
-
-        try:
-            obs_date = datetime.strptime(str(row["observation_date"]), "%Y-%m-%d")
-        except Exception:
-            obs_date = None
-
-        lab_entry = {
-            "test_name": row["lab_test_name"],
-            "value": row["value"],
-            "unit": row.get("unit"),
-            "date": obs_date,
-        }
-
-        patients[pid]["labs"].append(lab_entry)
-
-        test = row["lab_test_name"]
+    """
+    Attach lab results (history + most recent per test) to patient profiles.
+    Safe to call once per chunk: latest values are merged with those already attached.
+    """
+    labs_df = labs_df[labs_df["patient_id"].isin(patients.keys())]
+    if labs_df.empty:
+        return
+
+    dates = pd.to_datetime(labs_df[LAB_DATE_COLUMN], format="%Y-%m-%d", errors="coerce")
+    entries = pd.DataFrame({
+        "patient_id": labs_df["patient_id"].astype(object),
+        "test_name": labs_df["lab_test_name"].astype(object),
+        "value": parse_lab_values(labs_df["value"]),
+        "unit": labs_df["unit"].astype(object) if "unit" in labs_df.columns else None,
+        # Unparseable dates are None; other blanks stay NaN, as read
+        "date": dates.astype(object).where(dates.notna(), None),
+    })
+
+    # Latest per (patient, test), in file order: the first reading, replaced only by a
+    # strictly newer dated one. So a test whose first reading is undated keeps it.
+    first = entries.drop_duplicates(["patient_id", "test_name"], keep="first")
+    newest = (
+        entries[dates.notna()]
+        .sort_values("date", ascending=False, kind="stable", key=lambda col: col.astype("datetime64[ns]"))
+        .drop_duplicates(["patient_id", "test_name"], keep="first")
+    )
+    latest = pd.concat([first[first["date"].isna()], newest]).drop_duplicates(
+        ["patient_id", "test_name"], keep="first"
+    )
+    # Tests in order of first appearance, as latest_labs was filled row by row
+    latest = first[["patient_id", "test_name"]].merge(latest, on=["patient_id", "test_name"], how="left")
+
+    # One records pass instead of a sub-frame per patient; each history keeps file order
+    for lab_entry in entries.to_dict("records"):
+        patients[lab_entry.pop("patient_id")]["labs"].append(lab_entry)
+
+    for lab_entry in latest.to_dict("records"):
+        pid = lab_entry.pop("patient_id")
+        test = lab_entry["test_name"]
         current_latest = patients[pid]["latest_labs"].get(test)
         if not current_latest or (
-            obs_date and current_latest.get("date") and obs_date > current_latest["date"]
+            lab_entry["date"] and current_latest.get("date") and lab_entry["date"] > current_latest["date"]
         ):
             patients[pid]["latest_labs"][test] = lab_entry
 
 
+def read_note(path: str) -> str:
+    """Read a single clinical note file."""
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().strip()
+
+
 def attach_notes_to_patients(patients: dict, notes_dir: str):
     """Attach clinical notes (if available) to patient profiles."""
+    # One directory walk instead of an exists() check per patient
+    note_paths = {}
+    if os.path.isdir(notes_dir):
+        with os.scandir(notes_dir) as entries:
+            note_paths = {
+                entry.name[:-len(".txt")]: entry.path
+                for entry in entries
+                if entry.name.endswith(".txt") and entry.is_file()
+            }
+
+    # Reads are I/O-bound, so overlap them in a thread pool
+    pids = [pid for pid in patients if pid in note_paths]
+    workers = min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        contents = dict(zip(pids, executor.map(read_note, (note_paths[pid] for pid in pids))))
+
     for pid, profile in patients.items():
-        note_path = os.path.join(notes_dir, f"{pid}.txt")
-        if os.path.exists(note_path):
-            with open(note_path, "r", encoding="utf-8") as f:
-                profile["notes"] = f.read().strip()
-        else:
-            profile["notes"] = ""
+        profile["notes"] = contents.get(pid, "")
 
 
 def build_patient_profiles(patients_csv: str, labs_csv: str,
                            notes_dir="assignment_data/clinical_notes") -> dict:
     """Return unified patient profiles keyed by patient_id."""
     patients = load_patients(patients_csv)
-    labs_df = load_lab_results(labs_csv)
-    attach_labs_to_patients(patients, labs_df)
+    with load_lab_results(labs_csv, chunksize=LAB_CHUNKSIZE) as chunks:
+        for labs_chunk in chunks:
+            attach_labs_to_patients(patients, labs_chunk)
     attach_notes_to_patients(patients, notes_dir)
     return patients
 
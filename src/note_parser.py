@@ -10,15 +10,32 @@ Features:
 - Returns PASS / FAIL / MAYBE with inline explanations.
 """
 
+import os
 import re
 import math
+import hashlib
+import sqlite3
 from collections import Counter
-from typing import Dict, Any
+from functools import lru_cache
+from typing import Dict, Any, Optional
 
-from sentence_transformers import SentenceTransformer, util
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 # Load a lightweight embedding model once
-model = SentenceTransformer("paraphrase-MiniLM-L3-v2")
+MODEL_NAME = "paraphrase-MiniLM-L3-v2"
+model = SentenceTransformer(MODEL_NAME)
+
+# Persistent embedding cache (sqlite); set MTW_EMBED_CACHE="" to disable
+EMBED_CACHE_PATH = os.environ.get(
+    "MTW_EMBED_CACHE", os.path.join(BASE_DIR, "output", ".cache", "embeddings.sqlite")
+)
+
+# Batch size for batched encoding of notes and criterion phrases
+EMBED_BATCH_SIZE = 64
 
 # Thresholds for semantic similarity
 SEMANTIC_PASS = 0.15
@@ -51,59 +68,275 @@ SYNONYMS = {
 }
 
 
+# Compiled once at import; tokenize() runs for every phrase in the fallback path
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# (synonym, lowercased synonym) pairs, so notes are not re-lowercased per synonym
+SYNONYMS_LOWER = {
+    concept: [(syn, syn.lower()) for syn in syns]
+    for concept, syns in SYNONYMS.items()
+}
+
+# One alternation per concept (longest synonym first) so a note is scanned once per concept
+SYNONYM_RE = {
+    concept: re.compile("|".join(
+        re.escape(syn_lower)
+        for _, syn_lower in sorted(pairs, key=lambda p: len(p[1]), reverse=True)
+    ))
+    for concept, pairs in SYNONYMS_LOWER.items()
+}
+
+
+class EmbeddingCache:
+    """
+    On-disk embedding cache keyed by sha256(model_name + "|" + text).
+    Vectors are stored as float32 bytes; the connection is opened lazily per process.
+    """
+
+    # Stay under SQLite's bound-parameter limit
+    BATCH = 500
+
+    def __init__(self, path: str, model_name: str):
+        self.path = path
+        self.model_name = model_name
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (hash TEXT PRIMARY KEY, vec BLOB)"
+            )
+            self._pid = os.getpid()
+        return self._conn
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}|{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: list) -> Dict[str, np.ndarray]:
+        found = {}
+        for start in range(0, len(keys), self.BATCH):
+            batch = keys[start:start + self.BATCH]
+            rows = self.conn.execute(
+                f"SELECT hash, vec FROM embeddings WHERE hash IN ({','.join('?' * len(batch))})",
+                batch,
+            )
+            found.update((h, np.frombuffer(vec, dtype=np.float32)) for h, vec in rows)
+        return found
+
+    def put_many(self, items: Dict[str, np.ndarray]):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (hash, vec) VALUES (?, ?)",
+                [(h, np.asarray(vec, dtype=np.float32).tobytes()) for h, vec in items.items()],
+            )
+
+
+embedding_cache = EmbeddingCache(EMBED_CACHE_PATH, MODEL_NAME) if EMBED_CACHE_PATH else None
+
+
 def tokenize(text: str):
     """Lowercase and extract alphanumeric tokens."""
-    return re.findall(r"[a-z0-9]+", text.lower())
-
+    return TOKEN_RE.findall(text.lower())
 
-def cosine_similarity(text1: str, text2: str) -> float:
-    """Simple bag-of-words cosine similarity."""
-    tokens1, tokens2 = tokenize(text1), tokenize(text2)
-    vec1, vec2 = Counter(tokens1), Counter(tokens2)
 
-    intersection = set(vec1.keys()) & set(vec2.keys())
-    numerator = sum(vec1[x] * vec2[x] for x in intersection)
+@lru_cache(maxsize=4096)
+def bow_counts(text: str) -> tuple:
+    """
+    Token counts of a text and their Euclidean norm (cached per text; do not mutate).
+    Sparse, so a cached entry grows with the text rather than with every token seen so far.
+    """
+    counts = Counter(tokenize(text))
+    return counts, math.sqrt(sum(v ** 2 for v in counts.values()))
 
-    sum1 = sum(v**2 for v in vec1.values())
-    sum2 = sum(v**2 for v in vec2.values())
-    denominator = math.sqrt(sum1) * math.sqrt(sum2)
 
+def bow_cosine(bow1: tuple, bow2: tuple) -> float:
+    """Cosine similarity of two (counts, norm) pairs from bow_counts."""
+    (counts1, norm1), (counts2, norm2) = bow1, bow2
+    denominator = norm1 * norm2
     if not denominator:
         return 0.0
+    if len(counts1) > len(counts2):  # walk the shorter text's tokens
+        counts1, counts2 = counts2, counts1
+    numerator = sum(count * counts2[token] for token, count in counts1.items() if token in counts2)
     return float(numerator) / denominator
 
 
-def query_notes(notes: str, criterion: Dict[str, Any]) -> str:
-    if not notes:
-        return f"MAYBE (no notes available for '{criterion.get('description','')}')"
+def cosine_similarity(text1: str, text2: str) -> float:
+    """Simple bag-of-words cosine similarity."""
+    return bow_cosine(bow_counts(text1), bow_counts(text2))
 
-    desc = criterion.get("description", "")
-    concepts = criterion.get("concepts", [])
+
+def init_worker():
+    """Process-pool initializer: one torch thread per worker to avoid oversubscribing cores."""
+    torch.set_num_threads(1)
+
+
+@lru_cache(maxsize=4096)
+def lowercase_note(notes: str) -> str:
+    """Lowercased note text, materialized once per note instead of once per criterion."""
+    return notes.lower()
+
+
+@lru_cache(maxsize=1024)
+def expand_criterion(desc: str, concepts: tuple):
+    """
+    Resolve a criterion's phrases and synonym patterns once; they repeat for every patient.
+    Returns (phrases, ((concept, synonym_regex), ...)).
+    """
     if not concepts:
         tokens = [w.lower() for w in desc.split() if len(w) > 3]
-        concepts = tokens[:5]
+        concepts = tuple(tokens[:5])
+
+    phrases = (desc,) + concepts
+    synonym_checks = tuple(
+        (concept, SYNONYM_RE[concept.lower()])
+        for concept in concepts
+        if concept.lower() in SYNONYM_RE
+    )
+    return phrases, synonym_checks
+
+
+def criterion_phrases(criterion: Dict[str, Any]) -> tuple:
+    """Phrases (description + concepts) a criterion is matched on."""
+    return expand_criterion(criterion.get("description", ""), tuple(criterion.get("concepts") or ()))[0]
+
+
+def encode_texts(texts: list) -> np.ndarray:
+    """Run the model on texts in one batched call; rows are L2-normalized float32."""
+    return model.encode(
+        texts,
+        batch_size=EMBED_BATCH_SIZE,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=False,
+    ).astype(np.float32, copy=False)
+
+
+def embed_texts(texts) -> np.ndarray:
+    """
+    Embed texts; rows are L2-normalized float32, so dot product = cosine.
+    Texts found in the persistent cache are not re-encoded; the rest go through one batched call.
+    """
+    texts = list(texts)
+    if embedding_cache is None:
+        return encode_texts(texts)
+    if not texts:
+        return np.zeros((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+
+    keys = [embedding_cache.key(text) for text in texts]
+    vectors = embedding_cache.get_many(list(set(keys)))
+    misses = {key: text for key, text in zip(keys, texts) if key not in vectors}
+    if misses:
+        encoded = dict(zip(misses, encode_texts(list(misses.values()))))
+        embedding_cache.put_many(encoded)
+        vectors.update(encoded)
+    return np.stack([vectors[key] for key in keys])
+
+
+@lru_cache(maxsize=8192)
+def embed_note(notes: str) -> np.ndarray:
+    """Embed a single note; cached so callers without precomputed scores encode each note once."""
+    return embed_texts([notes])[0]
+
+
+@lru_cache(maxsize=1024)
+def embed_phrases(phrases: tuple) -> np.ndarray:
+    """Embed all phrases of a criterion in one batched call; cached since they repeat for every patient."""
+    return embed_texts(phrases)
+
+
+def embed_notes(notes: list) -> np.ndarray:
+    """Embed all notes in one batched call, shape (n_notes, dim); empty notes get zero rows."""
+    matrix = np.zeros((len(notes), model.get_sentence_embedding_dimension()), dtype=np.float32)
+    rows = [i for i, text in enumerate(notes) if text]
+    if rows:
+        matrix[rows] = embed_texts([notes[i] for i in rows])
+    return matrix
+
+
+def score_criteria(note_matrix: np.ndarray, criteria: list,
+                   phrase_scores: Optional[dict] = None) -> np.ndarray:
+    """
+    Max semantic similarity of each note to each criterion's phrases, shape (n_notes, n_criteria).
+    All new phrases are embedded in one call and scored against every note with a single matmul.
+    phrase_scores, if given, maps phrase -> similarity column for this note_matrix and is filled in;
+    phrases already in it (e.g. shared with an earlier protocol) are not embedded or scored again.
+    """
+    if not criteria:
+        return np.zeros((len(note_matrix), 0), dtype=np.float32)
+    if phrase_scores is None:
+        phrase_scores = {}
+
+    phrase_lists = [criterion_phrases(crit) for crit in criteria]
+    new = list(dict.fromkeys(
+        phrase for phrases in phrase_lists for phrase in phrases if phrase not in phrase_scores
+    ))
+    if new:
+        # Both operands C-contiguous float32, so the product is a single BLAS sgemm
+        # (a float64 or strided operand would upcast or copy first)
+        notes = np.ascontiguousarray(note_matrix, dtype=np.float32)
+        phrase_matrix = np.ascontiguousarray(embed_texts(new), dtype=np.float32)
+        sims = notes @ phrase_matrix.T
+        phrase_scores.update(zip(new, sims.T))
+
+    # Phrase columns laid out criterion by criterion, then max-reduced per criterion in one call
+    columns = np.stack([phrase_scores[phrase] for phrases in phrase_lists for phrase in phrases], axis=1)
+    starts = np.cumsum([0] + [len(phrases) for phrases in phrase_lists[:-1]])
+    return np.maximum.reduceat(columns, starts, axis=1)
+
+
+def query_notes(notes: str, criterion: Dict[str, Any],
+                semantic_score: Optional[float] = None) -> str:
+    """
+    Check a criterion against a patient's notes.
+    Pass semantic_score (from score_criteria) to skip embedding entirely.
+    """
+    desc = criterion.get("description", "")
+    concepts = tuple(criterion.get("concepts") or ())
+    if semantic_score is None:
+        return match_notes.__wrapped__(notes, desc, concepts, None)
+    # Precomputed scores make the result a pure function of its inputs; criteria
+    # repeated across protocols get the same score, so their answers are reused
+    return match_notes(notes, desc, concepts, float(semantic_score))
+
+
+@lru_cache(maxsize=100_000)
+def match_notes(notes: str, desc: str, concepts: tuple,
+                semantic_score: Optional[float] = None) -> str:
+    """query_notes on hashable inputs; cached when the semantic score is given."""
+    if not notes:
+        return f"MAYBE (no notes available for '{desc}')"
 
-    phrases = [desc] + concepts
+    phrases, synonym_checks = expand_criterion(desc, concepts)
 
     # Synonym shortcut
-    for concept in concepts:
-        for syn in SYNONYMS.get(concept.lower(), []):
-            if syn.lower() in notes.lower():
+    notes_lower = lowercase_note(notes)
+    for concept, pattern in synonym_checks:
+        if not pattern.search(notes_lower):
+            continue
+        # Hit: report the first synonym in list order, as before
+        for syn, syn_lower in SYNONYMS_LOWER[concept.lower()]:
+            if syn_lower in notes_lower:
                 return f"MAYBE (notes mention '{syn}', possible {concept})"
 
     # Semantic similarity
-    embeddings = model.encode([notes] + phrases, convert_to_tensor=True)
-    scores = util.cos_sim(embeddings[0], embeddings[1:])[0]
-    max_score = float(scores.max())
+    if semantic_score is None:
+        semantic_score = (embed_phrases(phrases) @ embed_note(notes)).max()
+    max_score = float(semantic_score)
 
     if max_score >= SEMANTIC_PASS:
         return f"PASS (semantic match for '{desc}', score={max_score:.2f})"
     elif max_score >= SEMANTIC_MAYBE:
         return f"MAYBE (weak semantic match for '{desc}', score={max_score:.2f})"
 
-    # Fallback: bag-of-words
-    bow_scores = [cosine_similarity(notes, phrase) for phrase in phrases]
-    max_bow = max(bow_scores) if bow_scores else 0.0
+    # Fallback: bag-of-words (note and phrase counts are cached across calls)
+    notes_bow = bow_counts(notes)
+    bow_scores = [bow_cosine(notes_bow, bow_counts(phrase)) for phrase in phrases]
+    max_bow = max(bow_scores, default=0.0)
 
     if max_bow >= COSINE_PASS:
         return f"PASS (cosine match for '{desc}', score={max_bow:.2f})"
@@ -13,78 +13,120 @@ Usage:
 """
 
 import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from data_loader import build_patient_profiles
+from note_parser import embed_notes, score_criteria, init_worker
 from protocol_sorter import sort_protocols
-from protocol_evaluator import evaluate_patient
+from protocol_evaluator import compile_criterion, evaluate_compiled, evaluate_patient
 from utils import write_json
 
+# Target number of tasks per worker; larger cohorts get proportionally larger chunks
+TASKS_PER_WORKER = 4
+
+# Sort group per is_eligible value: True, then MAYBE, then False
+ELIGIBILITY_GROUPS = {True: 0, "MAYBE": 1, False: 2}
+
+
+def result_sort_key(r: dict) -> tuple:
+    """Sort key for results: eligibility group, then confidence descending ("NA" counts as 0)."""
+    score = r["confidence_score"]
+    return (ELIGIBILITY_GROUPS[r["is_eligible"]], -score if score != "NA" else 0.0)
+
+
+def evaluate_protocol(patients: dict, protocol: dict, note_matrix,
+                      pool=None, chunksize=1, phrase_scores=None) -> list:
+    """
+    Evaluate every patient against one protocol, in a process pool if given
+    (chunksize patients per task).
+    note_matrix holds the patients' note embeddings, in patients order;
+    phrase_scores caches phrase similarities against note_matrix across protocols.
+    """
+    profiles = list(patients.values())
+    # Structured criteria are compiled once per protocol, then checked per patient
+    compiled = [compile_criterion(crit) for crit in protocol.get("structured", [])]
+    structured = [evaluate_compiled(patient, compiled) for patient in profiles]
+    # One embedding call for the protocol's phrases, one matmul against all notes
+    semantic = score_criteria(note_matrix, protocol.get("unstructured", []), phrase_scores)
+
+    if pool is None:
+        return [evaluate_patient(patient, protocol, evidence, scores)
+                for patient, evidence, scores in zip(profiles, structured, semantic)]
+    return list(pool.map(evaluate_patient, profiles, repeat(protocol), structured, semantic,
+                         chunksize=chunksize))
+
 
 def run_workflow(patients_csv: str, labs_csv: str, notes_dir: str,
-                 protocols_dir: str, outputs_dir="output"):
+                 protocols_dir: str, outputs_dir="output", workers: int = 1):
     """
     Full workflow runner.
+    With workers > 1, patients are evaluated in a pool of that many processes.
     """
     patients = build_patient_profiles(patients_csv, labs_csv, notes_dir)
     print(f"Loaded {len(patients)} patient profiles")
 
+    # Encode every patient's notes once; reused across all protocols and criteria
+    note_matrix = embed_notes([patient["notes"] for patient in patients.values()])
+    # Phrase -> similarity column; phrases repeated across protocols are scored once
+    phrase_scores = {}
+
     protocols = sort_protocols(protocols_dir)
     print(f"Loaded {len(protocols)} normalized protocols")
 
-    for protocol in protocols:
-        results = []
-        print(f"\n=== Protocol: {protocol['protocol_id']} ===")
-
-        # Evaluate each patient
-        for patient in patients.values():
-            result = evaluate_patient(patient, {
-                "id": protocol["protocol_id"],
-                "structured": protocol.get("structured_criteria", []),
-                "unstructured": protocol.get("unstructured_criteria", []),
-            })
-            results.append(result)
-
-        # Sort patients: True/MAYBE by confidence desc, then False
-        def sort_key(r):
-            elig = r["is_eligible"]
-            score = r["confidence_score"]
-            score_val = score if isinstance(score, (int, float)) else 0.0
-
-            if elig is True:
-                group = 0
-            elif elig == "MAYBE":
-                group = 1
-            else:  # False
-                group = 2
-
-            return (group, -score_val)
-
-        results.sort(key=sort_key)
-
-        # Console print and protocol-level summary
-        passed_patients = 0
-        for r in results:
-            score = r["confidence_score"]
-            is_eligible = r["is_eligible"]
-
-            if is_eligible is True:
-                passed_patients += 1
-
-            print(
-                f"Patient {r['patient_id']} | "
-                f"confidence_score = {score} | "
-                f"is_eligible = {is_eligible}"
-            )
-
-        percent_patients = (passed_patients / len(results)) * 100 if results else 0
+    # One pool for all protocols; workers load the model once and are reused
+    pool, chunksize = None, 1
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+        chunksize = max(1, len(patients) // (workers * TASKS_PER_WORKER))
+    try:
+        for protocol in protocols:
+            process_protocol(patients, protocol, note_matrix, outputs_dir,
+                             pool, chunksize, phrase_scores)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def process_protocol(patients: dict, protocol: dict, note_matrix, outputs_dir: str,
+                     pool=None, chunksize=1, phrase_scores=None):
+    """Evaluate, sort, print and save results for a single protocol."""
+    print(f"\n=== Protocol: {protocol['protocol_id']} ===")
+
+    # Evaluate each patient
+    results = evaluate_protocol(patients, {
+        "id": protocol["protocol_id"],
+        "structured": protocol.get("structured_criteria", []),
+        "unstructured": protocol.get("unstructured_criteria", []),
+    }, note_matrix, pool, chunksize, phrase_scores)
+
+    # Sort patients: True/MAYBE by confidence desc, then False
+    results.sort(key=result_sort_key)
+
+    # Console print and protocol-level summary
+    passed_patients = 0
+    for r in results:
+        score = r["confidence_score"]
+        is_eligible = r["is_eligible"]
+
+        if is_eligible is True:
+            passed_patients += 1
+
         print(
-            f"Protocol summary: {passed_patients}/{len(results)} patients eligible "
-            f"({percent_patients:.1f}%)"
+            f"Patient {r['patient_id']} | "
+            f"confidence_score = {score} | "
+            f"is_eligible = {is_eligible}"
         )
 
-        # Save sorted results
-        out_path = write_json(f"{protocol['protocol_id']}_results",
-                              results, out_dir=outputs_dir)
-        print(f"Saved results for {protocol['protocol_id']} -> {out_path}")
+    percent_patients = (passed_patients / len(results)) * 100 if results else 0
+    print(
+        f"Protocol summary: {passed_patients}/{len(results)} patients eligible "
+        f"({percent_patients:.1f}%)"
+    )
+
+    # Save sorted results
+    out_path = write_json(f"{protocol['protocol_id']}_results",
+                          results, out_dir=outputs_dir)
+    print(f"Saved results for {protocol['protocol_id']} -> {out_path}")
 
 
 if __name__ == "__main__":
@@ -95,5 +137,9 @@ if __name__ == "__main__":
     protocols_dir = os.path.join(BASE_DIR, "assignment_data")
     outputs_dir = os.path.join(BASE_DIR, "output")
 
+    # MTW_PARALLEL=1 uses every core unless MTW_WORKERS sets the count explicitly
+    default_workers = (os.cpu_count() or 1) if os.environ.get("MTW_PARALLEL") == "1" else 1
+    workers = int(os.environ.get("MTW_WORKERS", default_workers))
+
     os.makedirs(outputs_dir, exist_ok=True)
-    run_workflow(patients_csv, labs_csv, notes_dir, protocols_dir, outputs_dir)
+    run_workflow(patients_csv, labs_csv, notes_dir, protocols_dir, outputs_dir, workers)
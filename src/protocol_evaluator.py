@@ -8,113 +8,170 @@ Evaluates patient eligibility against trial protocols.
 - Produces PASS / FAIL / MAYBE for each criterion with inline explanations
 """
 
+import operator
+from collections import Counter
 from datetime import datetime
-from note_parser import query_notes
-
+from enum import IntEnum
+from typing import Optional
 
-def evaluate_structured(patient: dict, criteria: list) -> dict:
-    """Evaluate structured criteria (demographics, labs, age)."""
-    evidence = {}
+from note_parser import query_notes
 
-    for crit in criteria:
-        desc = crit.get("description", str(crit))
-        field = crit.get("field") or crit.get("type")
-        op = crit.get("condition")
-        value = crit.get("value")
-        actual = None
-
-        # Resolve actual patient value
-        if field == "age":
-            actual = patient.get("age")
-        elif field == "BMI":
-            actual = patient.get("BMI")
-        elif field == "pack_years":
-            actual = patient.get("pack_years")
-        elif field in patient.get("latest_labs", {}):
-            actual = patient["latest_labs"][field]["value"]
-        elif field in patient:
-            actual = patient.get(field)
-
-        # No data → MAYBE
-        if actual is None:
-            evidence[desc] = f"MAYBE (no data for {field})"
-            continue
-
-        # Numeric comparisons
-        if op in ["lt", "lte", "gt", "gte", "between"]:
+# Numeric condition -> (comparison, symbol used in evidence strings)
+NUMERIC_OPS = {
+    "lt": (operator.lt, "lt"),
+    "lte": (operator.le, "<="),
+    "gt": (operator.gt, "gt"),
+    "gte": (operator.ge, ">="),
+}
+
+
+class Verdict(IntEnum):
+    """Criterion outcome, as tagged at the start of each evidence string."""
+    FAIL = -1
+    MAYBE = 0
+    PASS = 1
+
+
+def verdict_of(entry: str) -> Optional[Verdict]:
+    """Verdict tagged on an evidence string, or None if it has no known tag."""
+    return Verdict.__members__.get(entry.split(" ", 1)[0])
+
+
+def resolve_field(patient: dict, field):
+    """Resolve a criterion field to the patient's value: derived metrics, latest labs, then profile."""
+    if field in ("age", "BMI", "pack_years"):
+        return patient.get(field)
+    if field in patient.get("latest_labs", {}):
+        return patient["latest_labs"][field]["value"]
+    if field in patient:
+        return patient.get(field)
+    return None
+
+
+def compile_criterion(crit: dict) -> tuple:
+    """
+    Specialize one structured criterion once, for reuse across patients.
+    Returns (description, field, check); check(actual) gives the evidence string
+    for a patient's value, or None when the criterion records no entry.
+    """
+    desc = crit.get("description", str(crit))
+    field = crit.get("field") or crit.get("type")
+    op = crit.get("condition")
+    value = crit.get("value")
+    no_data = f"MAYBE (no data for {field})"
+    unevaluable = f"MAYBE (could not evaluate {field} with {op})"
+    # Constant parts of the evidence strings; only the patient's value is formatted per call
+    pass_head, fail_head = f"PASS ({field}=", f"FAIL ({field}="
+
+    # Numeric comparisons
+    if op in NUMERIC_OPS:
+        compare, symbol = NUMERIC_OPS[op]
+        pass_tail, fail_tail = f" {symbol} {value})", f" not {symbol} {value})"
+
+        def check(actual):
+            if actual is None:
+                return no_data
             try:
-                if op == "lt":
-                    evidence[desc] = (
-                        f"PASS ({field}={actual} lt {value})"
-                        if actual < value else
-                        f"FAIL ({field}={actual} not lt {value})"
-                    )
-                elif op == "lte":
-                    evidence[desc] = (
-                        f"PASS ({field}={actual} <= {value})"
-                        if actual <= value else
-                        f"FAIL ({field}={actual} not <= {value})"
-                    )
-                elif op == "gt":
-                    evidence[desc] = (
-                        f"PASS ({field}={actual} gt {value})"
-                        if actual > value else
-                        f"FAIL ({field}={actual} not gt {value})"
-                    )
-                elif op == "gte":
-                    evidence[desc] = (
-                        f"PASS ({field}={actual} >= {value})"
-                        if actual >= value else
-                        f"FAIL ({field}={actual} not >= {value})"
-                    )
-                elif op == "between" and isinstance(value, (list, tuple)) and len(value) == 2:
-                    lo, hi = value
-                    evidence[desc] = (
-                        f"PASS ({field}={actual} in range {lo}-{hi})"
+                return (
+                    f"{pass_head}{actual}{pass_tail}"
+                    if compare(actual, value) else
+                    f"{fail_head}{actual}{fail_tail}"
+                )
+            except Exception:
+                return unevaluable
+
+    elif op == "between":
+        if isinstance(value, (list, tuple)) and len(value) == 2:
+            lo, hi = value
+            pass_tail, fail_tail = f" in range {lo}-{hi})", f" not in range {lo}-{hi})"
+
+            def check(actual):
+                if actual is None:
+                    return no_data
+                try:
+                    return (
+                        f"{pass_head}{actual}{pass_tail}"
                         if lo <= actual <= hi else
-                        f"FAIL ({field}={actual} not in range {lo}-{hi})"
+                        f"{fail_head}{actual}{fail_tail}"
                     )
-            except Exception:
-                evidence[desc] = f"MAYBE (could not evaluate {field} with {op})"
+                except Exception:
+                    return unevaluable
+        else:  # malformed range: no entry unless data is missing
+            def check(actual):
+                return no_data if actual is None else None
+
+    # Equality checks
+    elif op in ["equals", "eq"]:
+        expected = str(value).lower()
+        exact, fail_tail = f"PASS ({field} exactly {value})", f" not equal {value})"
+
+        def check(actual):
+            if actual is None:
+                return no_data
+            return exact if str(actual).lower() == expected else f"{fail_head}{actual}{fail_tail}"
 
-        # Equality checks
-        elif op in ["equals", "eq"]:
-            evidence[desc] = (
-                f"PASS ({field} exactly {value})"
-                if str(actual).lower() == str(value).lower() else
-                f"FAIL ({field}={actual} not equal {value})"
-            )
+    else:
+        unsupported = f"MAYBE (unsupported op '{op}' for {field})"
 
-        else:
-            evidence[desc] = f"MAYBE (unsupported op '{op}' for {field})"
+        def check(actual):
+            return no_data if actual is None else unsupported
 
-    return evidence
+    return desc, field, check
 
 
-def evaluate_unstructured(patient: dict, criteria: list) -> dict:
+def evaluate_compiled(patient: dict, compiled: list) -> dict:
+    """Evaluate criteria compiled by compile_criterion for one patient."""
     evidence = {}
+    for desc, field, check in compiled:
+        entry = check(resolve_field(patient, field))
+        if entry is not None:
+            evidence[desc] = entry
+    return evidence
+
+
+def evaluate_structured(patient: dict, criteria: list) -> dict:
+    """Evaluate structured criteria (demographics, labs, age)."""
+    return evaluate_compiled(patient, [compile_criterion(crit) for crit in criteria])
+
+
+def evaluate_unstructured(patient: dict, criteria: list, semantic_scores=None,
+                          evidence: dict = None) -> dict:
+    """
+    Evaluate unstructured criteria against the patient's notes.
+    semantic_scores, if given, holds the precomputed semantic score per criterion.
+    Entries are added to evidence if given (and returned), else to a new dict.
+    """
+    if evidence is None:
+        evidence = {}
     notes = patient.get("notes", "")
 
-    for crit in criteria:
+    for i, crit in enumerate(criteria):
         desc = crit.get("description", str(crit))
-        evidence[desc] = query_notes(notes, crit)
+        score = None if semantic_scores is None else semantic_scores[i]
+        evidence[desc] = query_notes(notes, crit, score)
 
     return evidence
 
 
-def evaluate_patient(patient: dict, protocol: dict) -> dict:
-    """Run full evaluation of a single patient against a protocol with fail override."""
-    structured_evidence = evaluate_structured(patient, protocol.get("structured", []))
-    unstructured_evidence = evaluate_unstructured(patient, protocol.get("unstructured", []))
-    evidence = {**structured_evidence, **unstructured_evidence}
+def evaluate_patient(patient: dict, protocol: dict, structured_evidence: dict = None,
+                     semantic_scores=None) -> dict:
+    """
+    Run full evaluation of a single patient against a protocol with fail override.
+    structured_evidence (from evaluate_compiled) and semantic_scores
+    (the patient's row from note_parser.score_criteria) may be passed in when precomputed;
+    structured_evidence is then extended in place and becomes the result's evidence.
+    """
+    evidence = structured_evidence
+    if evidence is None:
+        evidence = evaluate_structured(patient, protocol.get("structured", []))
+    evaluate_unstructured(patient, protocol.get("unstructured", []), semantic_scores, evidence)
 
     total = len(evidence)
-    passes = sum(1 for v in evidence.values() if v.startswith("PASS"))
-    maybes = sum(1 for v in evidence.values() if v.startswith("MAYBE"))
-    fails = sum(1 for v in evidence.values() if v.startswith("FAIL"))
+    verdicts = Counter(map(verdict_of, evidence.values()))
+    passes, maybes = verdicts[Verdict.PASS], verdicts[Verdict.MAYBE]
 
     # If any FAIL → disqualified
-    if fails > 0:
+    if verdicts[Verdict.FAIL] > 0:
         is_eligible = False
         score = "NA"
     else:
@@ -12,35 +12,65 @@ Usage:
 """
 
 import os
+import copy
+import hashlib
+import pickle
 import yaml
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    # LibYAML C parser and emitter; several times faster than the pure-Python ones
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader, SafeDumper
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 ASSIGNMENT_DIR = os.path.join(BASE_DIR, "assignment_data")
 
+# Criterion keys and types that classify a criterion as structured / unstructured
+STRUCTURED_KEYS = frozenset({"value", "metric", "unit"})
+STRUCTURED_TYPES = frozenset({"age", "calculated_metric", "smoker_status", "lab_test"})
+UNSTRUCTURED_TYPES = frozenset({"medical_history", "diagnosis", "text"})
+UNTYPED = frozenset({"", "unknown"})
+
 # Track unknown criterion types we encounter
 UNKNOWN_TYPES = set()
 
+# Upper bound on threads normalizing protocol files concurrently
+MAX_SORT_THREADS = 8
+
+# Parsed YAML per path, reused while the file is unchanged: {path: ((mtime_ns, size), data)}
+_YAML_CACHE = {}
+
+# On-disk copy of _YAML_CACHE for repeat runs (pickles); set MTW_YAML_CACHE="" to disable
+YAML_CACHE_DIR = os.environ.get("MTW_YAML_CACHE", os.path.join(BASE_DIR, "output", ".cache", "yaml"))
+
+# Normalized protocols are cached alongside, under this suffix; the version is
+# a hash of this module's source, so editing the classification sets or
+# normalize_protocol invalidates every cached entry
+NORMALIZED_SUFFIX = ".clean.pkl"
+with open(__file__, "rb") as _source:
+    NORMALIZED_CACHE_VERSION = hashlib.sha1(_source.read()).hexdigest()
 
-def classify_criterion(crit: dict) -> str:
-    """Classify a criterion into structured/unstructured, log unknowns."""
+
+def classify_criterion(crit: dict, unknown_types: set = None) -> str:
+    """Classify a criterion into structured/unstructured, log unknowns (to UNKNOWN_TYPES by default)."""
     ctype = str(crit.get("type", "")).lower()
 
-    if any(k in crit for k in ["value", "metric", "unit"]):
-        return "structured"
-    if ctype in {"age", "calculated_metric", "smoker_status", "lab_test"}:
+    if not STRUCTURED_KEYS.isdisjoint(crit) or ctype in STRUCTURED_TYPES:
         return "structured"
-    if "concepts" in crit or ctype in {"medical_history", "diagnosis", "text"}:
+    if "concepts" in crit or ctype in UNSTRUCTURED_TYPES:
         return "unstructured"
 
     # Log new/unexpected types
-    if ctype not in {"", "unknown"}:
-        UNKNOWN_TYPES.add(ctype)
+    if ctype not in UNTYPED:
+        (UNKNOWN_TYPES if unknown_types is None else unknown_types).add(ctype)
     return "unstructured"
 
 
-def fix_and_load_yaml(path: str):
-    """Ensure YAML is valid by wrapping dangling lists under 'criteria:'."""
-    lines = open(path, "r").read().splitlines()
+def wrap_dangling_list(text: str) -> str:
+    """Wrap a top-level list that follows the header under 'criteria:'."""
+    lines = text.splitlines()
     header, body = [], []
     hit_list = False
 
@@ -53,14 +83,75 @@ def fix_and_load_yaml(path: str):
             header.append(line)
 
     if body:
-        fixed = "\n".join(header + ["criteria:"] + ["  " + l for l in body])
-    else:
-        fixed = "\n".join(lines)
+        return "\n".join(header + ["criteria:"] + ["  " + l for l in body])
+    return "\n".join(lines)
 
-    return yaml.safe_load(fixed)
 
+def file_stamp(path: str):
+    """(mtime_ns, size) of path, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
 
-def normalize_protocol(raw: dict, proto_id: str) -> dict:
+
+def yaml_cache_path(path: str, suffix: str = ".pkl") -> str:
+    """Pickle file caching the parsed (or, by suffix, normalized) YAML at path."""
+    digest = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(YAML_CACHE_DIR, f"{os.path.basename(path)}.{digest}{suffix}")
+
+
+def read_yaml_cache(path: str, suffix: str = ".pkl"):
+    """Return the entry pickled for path by an earlier run, or None."""
+    try:
+        with open(yaml_cache_path(path, suffix), "rb") as f:
+            return pickle.load(f)
+    except Exception:  # missing or unreadable cache entry
+        return None
+
+
+def write_yaml_cache(path: str, entry: tuple, suffix: str = ".pkl"):
+    """Pickle an entry for path; written to a temp file, then renamed into place."""
+    cache_path = yaml_cache_path(path, suffix)
+    os.makedirs(YAML_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+
+
+def fix_and_load_yaml(path: str):
+    """Ensure YAML is valid by wrapping dangling lists under 'criteria:'."""
+    stamp = file_stamp(path)
+    if stamp is None:
+        raise FileNotFoundError(path)
+    cached = _YAML_CACHE.get(path)
+    if cached is None and YAML_CACHE_DIR:
+        cached = read_yaml_cache(path)
+    if cached and cached[0] == stamp:
+        _YAML_CACHE[path] = cached
+        # Callers mutate criteria (fallback concepts), so hand out a copy
+        return copy.deepcopy(cached[1])
+
+    # Well-formed files parse as a mapping straight from the stream;
+    # only the ones that don't are read into memory and rewritten
+    with open(path, "r") as f:
+        try:
+            data = yaml.load(f, Loader=SafeLoader)
+        except yaml.YAMLError:
+            data = None
+    if not isinstance(data, dict):
+        with open(path, "r") as f:
+            data = yaml.load(wrap_dangling_list(f.read()), Loader=SafeLoader)
+
+    _YAML_CACHE[path] = (stamp, data)
+    if YAML_CACHE_DIR:
+        write_yaml_cache(path, _YAML_CACHE[path])
+    return copy.deepcopy(data)
+
+
+def normalize_protocol(raw: dict, proto_id: str, unknown_types: set = None) -> dict:
     clean = {
         "protocol_id": raw.get("protocol_id", proto_id),
         "study_name": raw.get("study_name", "Unnamed Study"),
@@ -72,7 +163,7 @@ def normalize_protocol(raw: dict, proto_id: str) -> dict:
         if isinstance(value, list):
             for crit in value:
                 if isinstance(crit, dict):
-                    bucket = classify_criterion(crit)
+                    bucket = classify_criterion(crit, unknown_types)
                     # 🔑 Fallback concepts if not defined
                     if bucket == "unstructured" and "concepts" not in crit:
                         desc = crit.get("description", "")
@@ -83,21 +174,54 @@ def normalize_protocol(raw: dict, proto_id: str) -> dict:
     return clean
 
 
-def normalize_file(in_path: str, out_path: str):
-    """Normalize a single YAML file and save it."""
-    raw = fix_and_load_yaml(in_path) or {}
-    proto_id = os.path.splitext(os.path.basename(in_path))[0]
-    clean = normalize_protocol(raw, proto_id)
+def load_normalized(in_path: str, out_path: str):
+    """
+    Normalized protocol cached by an earlier run, or None if in_path or out_path
+    changed since. A hit also re-logs the file's unknown criterion types.
+    """
+    cached = read_yaml_cache(in_path, NORMALIZED_SUFFIX) if YAML_CACHE_DIR else None
+    if not cached:
+        return None
+    version, in_stamp, cached_out_path, out_stamp, unknown_types, clean = cached
+    if (version, in_stamp, cached_out_path, out_stamp) != (
+        NORMALIZED_CACHE_VERSION, file_stamp(in_path), out_path, file_stamp(out_path)
+    ):
+        return None
+    UNKNOWN_TYPES.update(unknown_types)
+    return clean
+
+
+def normalize_file(in_path: str, out_path: str, verbose: bool = True):
+    """Normalize a single YAML file and save it; files unchanged since the last run are reused."""
+    clean = load_normalized(in_path, out_path)
+    if clean is None:
+        unknown_types = set()
+        raw = fix_and_load_yaml(in_path) or {}
+        proto_id = os.path.splitext(os.path.basename(in_path))[0]
+        clean = normalize_protocol(raw, proto_id, unknown_types)
+
+        with open(out_path, "w") as f:
+            yaml.dump(clean, f, Dumper=SafeDumper, sort_keys=False)
+
+        UNKNOWN_TYPES.update(unknown_types)
+        if YAML_CACHE_DIR:
+            write_yaml_cache(in_path, (
+                NORMALIZED_CACHE_VERSION, file_stamp(in_path), out_path, file_stamp(out_path),
+                unknown_types, clean,
+            ), NORMALIZED_SUFFIX)
+
+    if verbose:
+        report_normalized(in_path, out_path, clean)
+    return clean
 
-    with open(out_path, "w") as f:
-        yaml.dump(clean, f, sort_keys=False)
 
+def report_normalized(in_path: str, out_path: str, clean: dict):
+    """Print the one-line summary for a normalized file."""
     print(
         f"Processed {os.path.basename(in_path)} → {os.path.basename(out_path)} "
         f"(structured={len(clean['structured_criteria'])}, "
         f"unstructured={len(clean['unstructured_criteria'])})"
     )
-    return clean
 
 
 def sort_protocols(in_dir: str = ASSIGNMENT_DIR) -> list:
@@ -105,17 +229,25 @@ def sort_protocols(in_dir: str = ASSIGNMENT_DIR) -> list:
     Normalize all protocol YAMLs in in_dir.
     Returns a list of cleaned protocol dicts for orchestrator.
     """
-    normalized = []
-    for fname in os.listdir(in_dir):
-        if fname.startswith("protocol_") and fname.endswith(".yaml") and not fname.endswith("_clean.yaml"):
-            in_path = os.path.join(in_dir, fname)
-            out_path = os.path.join(in_dir, fname.replace(".yaml", "_clean.yaml"))
-            clean = normalize_file(in_path, out_path)
-            normalized.append(clean)
+    # One directory scan; DirEntry carries the name and joined path
+    with os.scandir(in_dir) as entries:
+        protocol_files = [
+            (entry.path, os.path.join(in_dir, entry.name.replace(".yaml", "_clean.yaml")))
+            for entry in entries
+            if entry.name.startswith("protocol_") and entry.name.endswith(".yaml")
+            and not entry.name.endswith("_clean.yaml")
+        ]
+
+    # Files are independent: read, parse and write them concurrently, then report in order
+    with ThreadPoolExecutor(max_workers=min(MAX_SORT_THREADS, len(protocol_files) or 1)) as pool:
+        normalized = list(pool.map(lambda paths: normalize_file(*paths, verbose=False),
+                                   protocol_files))
+    for (in_path, out_path), clean in zip(protocol_files, normalized):
+        report_normalized(in_path, out_path, clean)
 
     if UNKNOWN_TYPES:
         print("\n[!] Unknown types encountered (defaulted to unstructured):")
-        for t in UNKNOWN_TYPES:
+        for t in sorted(UNKNOWN_TYPES):  # files are processed concurrently; fix the order
             print("   -", t)
 
     return normalized
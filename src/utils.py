@@ -16,7 +16,21 @@ Usage:
 
 import os
 import json
-from datetime import datetime
+from datetime import datetime, timezone
+
+from data_loader import CURRENT_DATE
+
+try:
+    # Rust JSON encoder; several times faster than the json module
+    import orjson
+except ImportError:  # fall back to the standard library
+    orjson = None
+
+# orjson options matching json.dumps(indent=2, default=str) for result records
+ORJSON_OPTIONS = (
+    orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME
+    if orjson else 0
+)
 
 
 def get_latest_lab(patient: dict, lab_name: str):
@@ -26,12 +40,17 @@ def get_latest_lab(patient: dict, lab_name: str):
 
 def most_recent_within(patient: dict, lab_name: str, days: int) -> bool:
     """
-    Check if the most recent lab is within the given number of days.
+    Check if the most recent lab is within the given number of days of CURRENT_DATE,
+    the same fixed reference date used for ages, so results do not depend on when the run happens.
+    Timezone-aware dates are compared in UTC, since CURRENT_DATE is naive.
     """
     lab = get_latest_lab(patient, lab_name)
     if not lab or not lab.get("date"):
         return False
-    return (datetime.now() - lab["date"]).days <= days
+    date = lab["date"]
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return (CURRENT_DATE - date).days <= days
 
 
 def format_evidence(label: str, explanation: str) -> str:
@@ -42,18 +61,38 @@ def format_evidence(label: str, explanation: str) -> str:
     return f"{label} ({explanation})"
 
 
-def write_json(protocol_id: str, results: list, out_dir="outputs"):
+def write_json(protocol_id: str, results, out_dir="outputs"):
     """
     Write evaluation results to JSON file.
     One file per protocol, containing all patient results.
+    Results may be any iterable; records are encoded and written one at a time,
+    with the same layout as json.dump(results, indent=2).
     """
     os.makedirs(out_dir, exist_ok=True)
     path = os.path.join(out_dir, f"{protocol_id}.json")
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(results, f, indent=2, default=str)
+    with open(path, "wb") as f:
+        f.write(b"[")
+        empty = True
+        for record in results:
+            f.write(b"\n  " if empty else b",\n  ")
+            f.write(encode_record(record).replace(b"\n", b"\n  "))
+            empty = False
+        f.write(b"]" if empty else b"\n]")
     return path
 
 
+def encode_record(record) -> bytes:
+    """Encode one result record as indented JSON bytes (orjson when installed)."""
+    if orjson is not None:
+        try:
+            data = orjson.dumps(record, default=str, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:  # e.g. a None or int key, which json writes as a string
+            data = None
+        if data is not None and data.isascii():  # json escapes non-ASCII text; keep files byte-identical
+            return data
+    return json.dumps(record, indent=2, default=str).encode("utf-8")
+
+
 if __name__ == "__main__":
     # Demo test for utils
     dummy_patient = {
@@ -69,5 +108,5 @@ if __name__ == "__main__":
 
     # Expected:
     # Latest HbA1c: {'value': 8.1, 'date': datetime(2024, 9, 15, 0, 0)}
-    # HbA1c recent within 180 days: False
+    # HbA1c recent within 180 days: True
     # Evidence: PASS (Age 56 is between 40 and 70 on 2024-05-01)